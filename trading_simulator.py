@@ -1,13 +1,74 @@
 import csv
-import random
+import queue
+import threading
 import time
 from typing import Optional, Tuple
 
 import cv2
 import numpy as np
+from numba import njit
+
+GREEN = np.array((0, 255, 0), dtype=np.uint8)
+RED = np.array((0, 0, 255), dtype=np.uint8)
+
+# Hotkey codes as returned by cv2.waitKey
+_K_BUY = ord("c")
+_K_SELL = ord("v")
+_K_STATUS = ord("s")
+_K_HELP = ord("q")
+_K_ESC = 27
+
+# Hotkey actions, looked up from 7-bit key codes through _ACTION
+_A_NONE, _A_BUY, _A_SELL, _A_STATUS, _A_HELP, _A_QUIT = range(6)
+_ACTION = [_A_NONE] * 128
+_ACTION[_K_BUY] = _A_BUY
+_ACTION[_K_SELL] = _A_SELL
+_ACTION[_K_STATUS] = _A_STATUS
+_ACTION[_K_HELP] = _A_HELP
+_ACTION[_K_ESC] = _A_QUIT
+_ACTION = tuple(_ACTION)
+
+
+@njit("void(uint8[:, :, :], int64, int64, float64, float64, float64, boolean, boolean, uint8[:])", cache=True)
+def paint_bar(buf, head, bar_width, next_val, expected_value, multiplier, show_ev, trade, colour):
+    """Paint the bar for next_val into columns [head, head + bar_width) of the ring buffer and their mirror.
+
+    Each row's colour is decided once, by priority: current value (white), then the trade region between the expected
+    value and next_val in colour if trade, then the expected value line (blue) if show_ev, otherwise black. Rows
+    outside the image are ignored.
+    """
+    height, mirror = buf.shape[0], buf.shape[1] // 2
+    ev_row = int(expected_value * multiplier)
+    val_row = int(multiplier * next_val)
+    lo_row = hi_row = 0
+    if trade:
+        if next_val > expected_value:
+            lo_row, hi_row = ev_row, int((next_val - 1) * multiplier)
+        else:
+            lo_row, hi_row = int((next_val - 1) * multiplier), ev_row
+    if not show_ev:
+        ev_row = -1
+    for i in range(height):
+        if i == val_row:
+            b, g, r = 255, 255, 255
+        elif lo_row <= i < hi_row:
+            b, g, r = colour[0], colour[1], colour[2]
+        elif i == ev_row:
+            b, g, r = 255, 0, 0
+        else:
+            b, g, r = 0, 0, 0
+        for j in range(head, head + bar_width):
+            buf[i, j, 0] = b
+            buf[i, j, 1] = g
+            buf[i, j, 2] = r
+            buf[i, j + mirror, 0] = b
+            buf[i, j + mirror, 1] = g
+            buf[i, j + mirror, 2] = r
 
 
 class TradingSimulator:
+    RAND_BATCH_SIZE = 4096
+
     def __init__(self,
                  n_max: int = 10,
                  n_min: int = 0,
@@ -52,7 +113,19 @@ class TradingSimulator:
         self.show_expected_value_line = show_expected_value_line
         self.debug_mode = debug_mode
 
-        self.trades = []
+        # Trades are streamed to trades.csv as they complete; the file is opened on the first trade
+        self._csv_file = None
+        self._csv_writer = None
+
+        # Open position as a running total of buy prices and number of buys
+        self._buy_sum = 0.0
+        self._buy_count = 0
+
+        # Uniform [0, 1) draws generated in batches (as Python floats) and consumed one per tick by number_generator
+        self._rng = np.random.default_rng()
+        self._rand_buf = self._rng.random(self.RAND_BATCH_SIZE).tolist()
+        self._rand_idx = 0
+
         self.possible_range = 9 * (self.n_max - self.n_min)
         self.expected_value = TradingSimulator.get_expected_value(n_max=n_max,
                                                                   n_min=n_min)
@@ -62,127 +135,190 @@ class TradingSimulator:
 
         assert self.image_shape[1] % self.n_ticks == 0
 
+        # Scrolling ring buffer twice the image width. Every column is written to both halves so that the
+        # displayed image is always a single slice of the buffer rather than a rolled copy.
+        self._buf = np.zeros((self.image_shape[0], 2 * self.image_shape[1], 3), dtype=np.uint8)
+        self._head = 0  # Column of the oldest bar, where the next bar is written
+        assert self._buf.dtype == np.uint8  # cv2.imshow rescales and converts any other dtype on every call
+        assert self._buf.flags.c_contiguous  # Keeps every frame's rows packed, so cv2.imshow does not copy it
+
+        # The simulation thread hands the latest frame to the display loop through a single slot queue (older frames
+        # are dropped) and keypresses are passed back through an unbounded queue.
+        self._frame_q = queue.Queue(maxsize=1)
+        self._key_q = queue.Queue()
+
+        # Hotkey handlers indexed by action, each called with the current tick value
+        self._handlers = (None, self._on_buy, self._on_sell, self._on_status, self._on_help, self._on_quit)
+
     def __call__(self):
-        run_simulator = True
-        bought_position = None
-        next_val = self.expected_value
-        previous_step_time = time.time()  # Time step 0
-
-        img = np.zeros((*self.image_shape, 3))
-        transaction_made_in_tick = 0
-        while run_simulator:
-            next_val = TradingSimulator.number_generator(
-                previous_value=next_val, expected_value=self.expected_value)
-            cv2.imshow("Trading Simulator", img)
-
-            k = cv2.waitKey(1)
-            if k == 27:  # Use ESC key to stop simulator
-                cv2.destroyAllWindows()
-                break
-            elif k == ord("c") and not transaction_made_in_tick:
-                # Buy
-                print(f"Bought at: {next_val}")
-                if bought_position is None:
-                    bought_position = [next_val]
-                else:
-                    bought_position.append(next_val)
-                img = self.update(img, next_val=next_val, bought=True)
-                # Assume can only buy once per candle
-                transaction_made_in_tick = True
-            elif k == ord(
-                    "v"
-            ) and bought_position is None and not transaction_made_in_tick:
-                print("No bought shares.")
-            elif k == ord("v") and not transaction_made_in_tick:
-                # Sell
-                img = self.update(img, next_val=next_val, sold=True)
-
-                mean_bought_position = np.mean(bought_position)
-                print(f"Sold at: {next_val}")
-                print(
-                    f"Profit: {mean_bought_position - next_val} (Buy: {mean_bought_position}, Sell: {next_val})"
-                )
-                self.trades.append({
-                    "buy": mean_bought_position,
-                    "sell": next_val
-                })
-                bought_position = None
-                # Assume can only sell once per candle
-                transaction_made_in_tick = True
-            elif k == ord("s"):
-                # Show position status
-                print(
-                    f"Position status: {np.mean(bought_position) if bought_position is not None else 0}"
-                )
-            elif k == ord("q"):
-                print(
-                    "c: Buy\nv: Sell\ns: Position status\nESC: Quit simulator")
-
-            current_time = time.time()
-            if current_time - previous_step_time > self.t_update:  # 1:
-                print(f"Step price: {next_val}")
-                if self.debug_mode:
-                    print(f"Time between ticks: {current_time - previous_step_time}")
-                previous_step_time = current_time
-                if not transaction_made_in_tick:
-                    img = self.update(img, next_val=next_val)
-                transaction_made_in_tick = False
-
-        # Log trades to CSV at end of simulation
-        if self.trades:
-            keys = self.trades[0].keys()
-            with open('trades.csv', 'w', newline='') as output_file:
-                writer = csv.DictWriter(output_file, keys)
-                writer.writeheader()
-                writer.writerows(self.trades)
+        self._running = True
+        self._error = None
 
-    @staticmethod
-    def number_generator(previous_value: int = 0,
+        # Ticks are simulated on a worker thread while HighGUI stays on the calling thread, as some backends (e.g.
+        # Cocoa on macOS) do not support GUI calls from other threads.
+        simulation_thread = threading.Thread(target=self._simulation_loop, daemon=True)
+        simulation_thread.start()
+        try:
+            self._display_loop()
+        finally:
+            self._running = False
+            self._key_q.put(-1)  # Wake the simulation loop if it is waiting for a key
+            simulation_thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def _simulation_loop(self):
+        try:
+            self._transaction_made_in_tick = False
+            self._dirty = True  # Whether the ring buffer has changed since the last frame was posted
+            next_val = self.number_generator(previous_value=self.expected_value, expected_value=self.expected_value)
+            previous_step_time = time.monotonic()  # Time step 0
+            next_deadline = previous_step_time + self.t_update
+
+            while self._running:
+                if self._dirty:
+                    self._post_frame(self.frame())
+                    self._dirty = False
+
+                # Sleep until the next tick unless a key is pressed first
+                try:
+                    k = self._key_q.get(timeout=max(0.0, next_deadline - time.monotonic()))
+                except queue.Empty:
+                    k = -1
+                action = _ACTION[k] if 0 <= k < 128 else _A_NONE
+                if action:
+                    self._handlers[action](next_val)
+                    if not self._running:
+                        break
+
+                current_time = time.monotonic()
+                if current_time >= next_deadline:
+                    print(f"Step price: {next_val}")
+                    if self.debug_mode:
+                        print(f"Time between ticks: {current_time - previous_step_time}")
+                    previous_step_time = current_time
+                    next_deadline += self.t_update
+                    if next_deadline < current_time:  # Fell behind, resume the cadence instead of bursting ticks
+                        next_deadline = current_time + self.t_update
+                    if not self._transaction_made_in_tick:
+                        self.update(next_val=next_val)
+                    self._transaction_made_in_tick = False
+                    next_val = self.number_generator(previous_value=next_val, expected_value=self.expected_value)
+        except BaseException as e:  # Re-raised by __call__ once the window is closed
+            self._error = e
+        finally:
+            self._running = False
+            self._post_frame(None)
+            if self._csv_file is not None:
+                self._csv_file.close()
+                self._csv_file = None
+
+    def _on_buy(self, next_val):
+        if self._transaction_made_in_tick:
+            return
+        print(f"Bought at: {next_val}")
+        self._buy_sum += next_val
+        self._buy_count += 1
+        self.update(next_val=next_val, bought=True)
+        # Assume can only buy once per candle
+        self._transaction_made_in_tick = True
+
+    def _on_sell(self, next_val):
+        if self._transaction_made_in_tick:
+            return
+        if not self._buy_count:
+            print("No bought shares.")
+            return
+        self.update(next_val=next_val, sold=True)
+
+        mean_bought_position = self._buy_sum / self._buy_count
+        print(f"Sold at: {next_val}")
+        print(f"Profit: {mean_bought_position - next_val} (Buy: {mean_bought_position}, Sell: {next_val})")
+        self._log_trade(mean_bought_position, next_val)
+        self._buy_sum = 0.0
+        self._buy_count = 0
+        # Assume can only sell once per candle
+        self._transaction_made_in_tick = True
+
+    def _on_status(self, next_val):
+        print(f"Position status: {self._buy_sum / self._buy_count if self._buy_count else 0}")
+
+    def _on_help(self, next_val):
+        print("c: Buy\nv: Sell\ns: Position status\nESC: Quit simulator")
+
+    def _on_quit(self, next_val):
+        self._running = False
+
+    def _log_trade(self, buy, sell):
+        if self._csv_file is None:
+            self._csv_file = open('trades.csv', 'w', newline='')
+            self._csv_writer = csv.writer(self._csv_file)
+            self._csv_writer.writerow(("buy", "sell"))
+        self._csv_writer.writerow((buy, sell))
+        # Trades are at most one per tick, so flushing each one is cheap and keeps the log intact if the process dies
+        self._csv_file.flush()
+
+    def _post_frame(self, frame):
+        """Hand a frame to the display loop, replacing any frame it has not shown yet. None closes the window."""
+        try:
+            self._frame_q.get_nowait()
+        except queue.Empty:
+            pass
+        self._frame_q.put(frame)
+
+    def _display_loop(self):
+        # The frame is a live view of the ring buffer; a bar written while it is being shown only tears one column,
+        # which the next frame corrects.
+        frame = self.frame()
+        while frame is not None:
+            cv2.imshow("Trading Simulator", frame)
+            while True:
+                # waitKey(1) paces this loop, so window events and keypresses are serviced every millisecond
+                k = cv2.waitKey(1)
+                if k != -1:
+                    self._key_q.put(k)
+                try:
+                    frame = self._frame_q.get_nowait()
+                    break
+                except queue.Empty:
+                    continue  # Nothing new to show
+        cv2.destroyAllWindows()
+
+    def number_generator(self,
+                         previous_value: int = 0,
                          expected_value: int = 0) -> int:
+        if self._rand_idx == self.RAND_BATCH_SIZE:
+            self._rand_buf = self._rng.random(self.RAND_BATCH_SIZE).tolist()
+            self._rand_idx = 0
+        u = self._rand_buf[self._rand_idx]
+        self._rand_idx += 1
         if previous_value > expected_value:
-            multiplier = previous_value * random.uniform(0.75, 1.1)
+            multiplier = previous_value * (0.75 + 0.35 * u)  # U(0.75, 1.1)
         else:
-            multiplier = previous_value * random.uniform(0.9, 1.25)
+            multiplier = previous_value * (0.9 + 0.35 * u)  # U(0.9, 1.25)
         return multiplier
 
     @staticmethod
     def get_expected_value(n_max: int, n_min: int):
         return 4.5 * (n_max - n_min)
 
+    def frame(self):
+        """View of the ring buffer ordered from the oldest to the newest bar.
+
+        The view is uint8 BGR with contiguous rows (only the row stride differs from a packed image), which OpenCV
+        wraps as a Mat with a row step instead of converting or copying it.
+        """
+        return self._buf[:, self._head:self._head + self.image_shape[1]]
+
     def update(self,
-               img,
                next_val: Optional[int] = None,
                bought=False,
                sold=False):
         # Update visualiser
-        next_col = np.zeros((self.image_shape[0], self.BAR_WIDTH, 3))
-        if bought:
-            colour = (0, 255, 0)  # Green
-        elif sold:
-            colour = (0, 0, 255)  # Red
-
-        # Show expected value
-        if self.show_expected_value_line:
-            next_col[int(self.expected_value *
-                         self.BAR_HEIGHT_MULTIPLIER)] = (255, 0, 0)
-
-        if bought or sold:
-            if next_val > self.expected_value:
-                next_col[int(self.expected_value *
-                             self.BAR_HEIGHT_MULTIPLIER):int(
-                                 (next_val - 1) *
-                                 self.BAR_HEIGHT_MULTIPLIER)] = colour
-            else:
-                next_col[int((next_val - 1) * self.BAR_HEIGHT_MULTIPLIER
-                             ):int(self.expected_value *
-                                   self.BAR_HEIGHT_MULTIPLIER)] = colour
-
-        # Show current value
-        next_col[int(self.BAR_HEIGHT_MULTIPLIER * next_val)] = (255, 255, 255)
-
-        img = np.delete(img, obj=np.s_[:self.BAR_WIDTH], axis=1)
-        img = np.concatenate((img, next_col), axis=1)
-        return img
+        paint_bar(self._buf, self._head, self.BAR_WIDTH, float(next_val), float(self.expected_value),
+                  self.BAR_HEIGHT_MULTIPLIER, self.show_expected_value_line, bought or sold, RED if sold else GREEN)
+        self._head = (self._head + self.BAR_WIDTH) % self.image_shape[1]
+        self._dirty = True
 
 
 def tuple_type(value: str):